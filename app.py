@@ -2,9 +2,16 @@
 import os
 import io
 import re
+import glob
+import shutil
+import tempfile
+from collections import namedtuple
 import duckdb
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as papq
 import streamlit as st
 import plotly.express as px
 from urllib.request import urlopen, Request
@@ -23,24 +30,26 @@ PRIMARY_COLOR = st.get_option("theme.primaryColor") or "#D94F2A"  # fallback
 # ----------------------
 # UTILITIES
 # ----------------------
-@st.cache_data(show_spinner=False)
-def fetch_xls_from_url(url: str) -> bytes:
+# Store columns look like '002 Qty Sold' / '002 Qty On Hand'
+_STORE_RE = re.compile(r"^(\d{3})\s+Qty (Sold|On Hand)$")
+
+def fetch_xls_from_url(url: str):
+    # Stream into a spooled temp file: small workbooks stay in RAM, large
+    # ones spill to disk instead of being materialized twice as bytes
     req = Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    tmp = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
     with urlopen(req) as resp:
-        return resp.read()
-
-def convert_container_ml(val):
-    try:
-        # Values are like .3750 meaning 375 ml
-        num = float(val)
-        ml = int(round(num * 1000))
-        return f"{ml} ml"
-    except Exception:
-        return str(val)
-
-def parse_supplier_report(file_bytes: bytes) -> pd.DataFrame:
+        shutil.copyfileobj(resp, tmp, length=1 << 20)
+    tmp.seek(0)
+    return tmp
+
+def parse_supplier_report(file_obj) -> pa.Table:
+    # Accepts raw bytes (uploader) or a readable file object (URL fetch)
+    if isinstance(file_obj, (bytes, bytearray)):
+        file_obj = io.BytesIO(file_obj)
     # Read metadata rows (0..3) and header row at 4
-    xls = pd.ExcelFile(io.BytesIO(file_bytes))
+    # calamine (Rust) streams rows instead of building openpyxl's XML DOM
+    xls = pd.ExcelFile(file_obj, engine="calamine")
     df_head = pd.read_excel(xls, sheet_name="SUPPLIER REPORT", header=None, nrows=5)
     meta = {
         "fiscal_year": str(df_head.iat[0,1]).strip(),
@@ -48,37 +57,47 @@ def parse_supplier_report(file_bytes: bytes) -> pd.DataFrame:
         "inventory_pull_date": pd.to_datetime(df_head.iat[2,1], errors="coerce"),
         "sold_date_range": str(df_head.iat[3,1]).strip(),
     }
-    df = pd.read_excel(xls, sheet_name="SUPPLIER REPORT", header=4)
-    # Standardize column names
-    df.columns = [str(c).strip() for c in df.columns]
+    # Discover column names first so the full read only parses the columns we keep
+    header = pd.read_excel(xls, sheet_name="SUPPLIER REPORT", header=4, nrows=0)
+    raw_by_name = dict(zip(header.columns.astype(str).str.strip(), header.columns))
 
-    # Keep relevant columns
     base_cols = ["Item UPC","Item Description","Vendor Name","Class","Container Size","Retail Price","Total","Agent","Grocery","Licensee","Other","Public"]
-    base_cols_present = [c for c in base_cols if c in df.columns]
+    base_cols_present = [c for c in base_cols if c in raw_by_name]
+    # One pass over the header for the per-store Qty Sold columns; the melt
+    # derives store codes from the column names, and On Hand is never read
+    sold_cols = []
+    for c in raw_by_name:
+        m = _STORE_RE.match(c)
+        if m and m.group(2) == "Sold":
+            sold_cols.append(c)
+
+    # Declared dtypes skip per-cell inference; categories keep the melt compact
+    keep = {raw_by_name[c] for c in base_cols_present + sold_cols}
+    dtype = {"Item UPC": str, "Vendor Name": "category", "Class": "category", "Retail Price": "float64"}
+    dtype.update({c: "float32" for c in sold_cols})
+    dtype = {raw_by_name[c]: t for c, t in dtype.items() if c in raw_by_name}
+    df = pd.read_excel(xls, sheet_name="SUPPLIER REPORT", header=4,
+                       usecols=lambda c: c in keep, dtype=dtype)
+    # Standardize column names
+    df.columns = df.columns.astype(str).str.strip()
+
     core = df[base_cols_present].copy()
 
-    # Convert container to ml display
+    # Convert container to ml display; values are like .3750 meaning 375 ml.
+    # Vectorized: non-numeric sizes keep their original text.
     if "Container Size" in core.columns:
-        core["Container Size"] = core["Container Size"].apply(convert_container_ml).rename("Container Size")
-
-    # Identify store columns: pattern like '002 Qty Sold' and '002 Qty On Hand'
-    sold_cols = [c for c in df.columns if re.match(r"^\d{3}\s+Qty Sold$", c)]
-    onhand_cols = [c for c in df.columns if re.match(r"^\d{3}\s+Qty On Hand$", c)]
-    # Ensure aligned store codes
-    store_codes = sorted({c.split()[0] for c in sold_cols})
-    # Melt to long format
-    long_frames = []
-    for sc in store_codes:
-        sold_col = f"{sc} Qty Sold"
-        if sold_col not in df.columns:
-            continue
-        tmp = core.copy()
-        tmp["Store Code"] = sc
-        tmp["Qty Sold"] = df[sold_col].fillna(0).astype(float)
-        long_frames.append(tmp)
-    if not long_frames:
-        return pd.DataFrame()
-    sales_long = pd.concat(long_frames, ignore_index=True)
+        ml = (pd.to_numeric(core["Container Size"], errors="coerce") * 1000).round().astype("Int64")
+        core["Container Size"] = (ml.astype(str) + " ml").where(ml.notna(), core["Container Size"].astype(str))
+
+    if not sold_cols:
+        return pa.Table.from_pandas(pd.DataFrame(columns=SALES_COLUMNS), preserve_index=False)
+    # Melt to long format in a single pass (no per-store copy of core)
+    sales_long = pd.concat([core, df[sold_cols]], axis=1).melt(
+        id_vars=base_cols_present, value_vars=sold_cols,
+        var_name="_col", value_name="Qty Sold")
+    sales_long["Store Code"] = sales_long["_col"].str[:3]
+    sales_long = sales_long.drop(columns="_col")
+    sales_long["Qty Sold"] = sales_long["Qty Sold"].fillna(0).astype(float)
 
     # Rename columns per business terms
     sales_long = sales_long.rename(columns={
@@ -98,80 +117,291 @@ def parse_supplier_report(file_bytes: bytes) -> pd.DataFrame:
     sales_long["FiscalWeek"] = meta["fiscal_week"]
     sales_long["InventoryPullDate"] = meta["inventory_pull_date"]
     sales_long["SoldDateRange"] = meta["sold_date_range"]
-    return sales_long
+
+    # Hand DuckDB an Arrow table: ingest is zero-copy and skips a second
+    # pandas materialization of the long frame
+    sales_long = sales_long.rename(columns={"Store Code": "StoreCode", "Qty Sold": "QtySold"})
+    return pa.Table.from_pandas(sales_long.reindex(columns=SALES_COLUMNS), preserve_index=False)
 
 # ----------------------
 # DATABASE
 # ----------------------
 DB_PATH = os.environ.get("DB_PATH", "pumphouse.duckdb")
-con = duckdb.connect(DB_PATH)
-con.execute("""
-CREATE TABLE IF NOT EXISTS sales (
-    FiscalYear TEXT,
-    FiscalWeek TEXT,
-    InventoryPullDate TIMESTAMP,
-    SoldDateRange TEXT,
-    Brand TEXT,
-    Product TEXT,
-    Class TEXT,
-    Container TEXT,
-    RetailPrice DOUBLE,
-    Total DOUBLE,
-    Agent DOUBLE,
-    Grocery DOUBLE,
-    Licensee DOUBLE,
-    Other DOUBLE,
-    Public DOUBLE,
-    StoreCode TEXT,
-    QtySold DOUBLE,
-    Dollars DOUBLE
-);
-""")
-con.execute("""
-CREATE TABLE IF NOT EXISTS stores (
-    StoreCode TEXT PRIMARY KEY,
-    StoreName TEXT,
-    Address TEXT,
-    City TEXT,
-    Province TEXT,
-    Lat DOUBLE,
-    Lon DOUBLE
-);
-""")
-
-def upsert_sales(df: pd.DataFrame):
-    if df.empty:
+# Sales live as hive-partitioned Parquet (FiscalYear=... / FiscalWeek=...);
+# DuckDB scans them zero-copy with partition pruning on the week filter.
+# Only the stores directory stays as a DuckDB-managed table.
+SALES_DIR = os.environ.get("SALES_DIR", "sales")
+SALES_GLOB = os.path.join(SALES_DIR, "**", "*.parquet")
+# Column order of the sales dataset
+SALES_COLUMNS = [
+    "FiscalYear", "FiscalWeek", "InventoryPullDate", "SoldDateRange",
+    "Brand", "Product", "Class", "Container", "RetailPrice",
+    "Total", "Agent", "Grocery", "Licensee", "Other", "Public",
+    "StoreCode", "QtySold", "Dollars",
+]
+# Measure columns are cents-scale with 6-digit magnitude; fp32 has ample
+# precision and halves the bytes every scan moves
+SALES_REAL_COLUMNS = {"RetailPrice", "Total", "Agent", "Grocery", "Licensee",
+                      "Other", "Public", "QtySold", "Dollars"}
+
+def sales_exist():
+    return bool(glob.glob(SALES_GLOB, recursive=True))
+
+def _sales_fingerprint():
+    # Cheap identity for the on-disk dataset: file count plus newest mtime
+    files = glob.glob(SALES_GLOB, recursive=True)
+    if not files:
+        return ""
+    return f"{len(files)}:{max(os.path.getmtime(f) for f in files)}"
+
+def refresh_sales_weekly(c):
+    # Pre-aggregated rollup: dashboard aggregates scan thousands of rows
+    # here instead of the full row-level dataset. The rebuild and the
+    # fingerprint of the dataset it was built from commit together, so a
+    # crash mid-refresh can't leave a stale rollup that looks fresh.
+    if not sales_exist():
+        return
+    c.execute("BEGIN")
+    c.execute(f"""
+        CREATE OR REPLACE TABLE sales_weekly AS
+        SELECT FiscalYear, FiscalWeek, Brand, StoreCode, Class,
+               SUM(Dollars) AS Dollars, SUM(QtySold) AS QtySold
+        FROM read_parquet('{SALES_GLOB}', hive_partitioning = 1, hive_types_autocast = 0)
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+    c.execute("DELETE FROM rollup_meta")
+    c.execute("INSERT INTO rollup_meta VALUES (?)", [_sales_fingerprint()])
+    c.execute("COMMIT")
+
+@st.cache_resource(show_spinner=False)
+def _db():
+    # One connection per process, shared by every session. Reads run on
+    # per-rerun cursors and parallelize via the threads pragma; writes take
+    # their own cursor in upsert paths. (DuckDB refuses to open the same
+    # file read-only and read-write within one process, so a separate
+    # READ_ONLY handle is not an option here.)
+    c = duckdb.connect(DB_PATH)
+    c.execute(f"PRAGMA threads={os.cpu_count() or 4}")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS stores (
+        StoreCode TEXT PRIMARY KEY,
+        StoreName TEXT,
+        Address TEXT,
+        City TEXT,
+        Province TEXT,
+        Lat DOUBLE,
+        Lon DOUBLE
+    );
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sales_weekly (
+        FiscalYear TEXT,
+        FiscalWeek TEXT,
+        Brand TEXT,
+        StoreCode TEXT,
+        Class TEXT,
+        Dollars REAL,
+        QtySold REAL
+    );
+    """)
+    c.execute("CREATE TABLE IF NOT EXISTS rollup_meta (fingerprint TEXT);")
+    # Rebuild the rollup whenever it doesn't match the on-disk dataset:
+    # first run after an upgrade, or an ingest that died before refreshing
+    stored = c.execute("SELECT fingerprint FROM rollup_meta").fetchone()
+    if sales_exist() and (stored is None or stored[0] != _sales_fingerprint()):
+        refresh_sales_weekly(c)
+    return c
+
+# Each script rerun gets its own cursor over the shared connection, so
+# concurrent sessions don't serialize on one handle
+con = _db().cursor()
+
+def upsert_sales(tbl: pa.Table):
+    if tbl.num_rows == 0:
         return 0
-    # Deduplicate on key: FiscalYear, FiscalWeek, Product, StoreCode, Dollars/QtySold taken from latest
-    # We'll delete then insert for that slice
-    keys = df[["FiscalYear","FiscalWeek","Product","Store Code"]].drop_duplicates()
-    for _, row in keys.iterrows():
-        con.execute("""DELETE FROM sales WHERE FiscalYear=? AND FiscalWeek=? AND Product=? AND StoreCode=?""",
-                    [row["FiscalYear"], row["FiscalWeek"], row["Product"], row["Store Code"]])
-    con.execute("INSERT INTO sales SELECT * FROM df").df()
-    return len(df)
+    # Writes get a dedicated cursor, closed as soon as the ingest finishes
+    wcur = _db().cursor()
+    # A report covers whole fiscal weeks, so dedup is partition replacement:
+    # drop the FiscalYear/FiscalWeek partitions the batch touches, rewrite them
+    wcur.register("batch", tbl)
+    for fy, fw in wcur.execute("SELECT DISTINCT FiscalYear, FiscalWeek FROM batch").fetchall():
+        shutil.rmtree(os.path.join(SALES_DIR, f"FiscalYear={fy}", f"FiscalWeek={fw}"),
+                      ignore_errors=True)
+    os.makedirs(SALES_DIR, exist_ok=True)
+    select_cols = ", ".join(
+        f"CAST({c} AS REAL) AS {c}" if c in SALES_REAL_COLUMNS else c
+        for c in SALES_COLUMNS)
+    wcur.execute("""
+        COPY (SELECT {} FROM batch)
+        TO '{}' (FORMAT PARQUET, PARTITION_BY (FiscalYear, FiscalWeek), OVERWRITE_OR_IGNORE 1)
+    """.format(select_cols, SALES_DIR))
+    wcur.unregister("batch")
+    refresh_sales_weekly(wcur)
+    wcur.close()
+    st.cache_data.clear()
+    return tbl.num_rows
+
+def resort_sales():
+    # Rewrite the dataset with rows in store order inside each partition so
+    # parquet row-group statistics stay tight; run occasionally from Admin
+    if not sales_exist():
+        return
+    tmp_dir = SALES_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    con.execute(f"""
+        COPY (SELECT * FROM read_parquet('{SALES_GLOB}', hive_partitioning = 1, hive_types_autocast = 0)
+              ORDER BY FiscalYear, FiscalWeek, StoreCode)
+        TO '{tmp_dir}' (FORMAT PARQUET, PARTITION_BY (FiscalYear, FiscalWeek))
+    """)
+    old_dir = SALES_DIR + ".old"
+    # A crashed previous swap can leave sales.old behind; clear it or the
+    # rename below fails on every subsequent run
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.rename(SALES_DIR, old_dir)
+    os.rename(tmp_dir, SALES_DIR)
+    shutil.rmtree(old_dir)
 
 # ----------------------
-# SIDEBAR FILTERS
+# SIDEBAR FILTERS & QUERIES
 # ----------------------
-def load_data():
-    df = con.execute("""
+# Shared FROM/JOIN clause; every dashboard query aggregates in DuckDB and
+# returns only the rows the widget actually renders. hive_partitioning lets
+# DuckDB prune whole week directories on the FiscalWeek filter.
+FILTERED_SALES = f"""
+    FROM read_parquet('{SALES_GLOB}', hive_partitioning = 1, hive_types_autocast = 0) s
+    LEFT JOIN stores st ON st.StoreCode = s.StoreCode
+"""
+# Same shape over the weekly rollup; usable whenever a query doesn't need
+# Product or row-level columns
+WEEKLY_SALES = """
+    FROM sales_weekly s
+    LEFT JOIN stores st ON st.StoreCode = s.StoreCode
+"""
+
+@st.cache_data(ttl=300, show_spinner=False)
+def sidebar_options():
+    # One aggregate query for all five distinct-value lists; cached so widget
+    # interactions don't rescan the dataset. upsert paths clear the cache.
+    if not sales_exist():
+        return [], [], [], [], []
+    row = con.execute(f"""
+        SELECT ARRAY_AGG(DISTINCT s.FiscalWeek ORDER BY s.FiscalWeek),
+               ARRAY_AGG(DISTINCT s.Brand ORDER BY s.Brand),
+               ARRAY_AGG(DISTINCT s.StoreCode ORDER BY s.StoreCode),
+               ARRAY_AGG(DISTINCT st.City ORDER BY st.City),
+               ARRAY_AGG(DISTINCT s.Product ORDER BY s.Product)
+        {FILTERED_SALES}
+    """).fetchone()
+    return tuple([v for v in lst if v is not None] if lst else [] for lst in row)
+
+def build_filters(fiscal_week_sel, brand_sel, store_sel, city_sel, sku_sel):
+    # Translate sidebar selections into a parameterized WHERE clause
+    clauses, params = [], []
+    for col, sel in (("s.FiscalWeek", fiscal_week_sel), ("s.Brand", brand_sel),
+                     ("s.StoreCode", store_sel), ("st.City", city_sel),
+                     ("s.Product", sku_sel)):
+        if sel:
+            clauses.append("{} IN ({})".format(col, ", ".join("?" * len(sel))))
+            params.extend(sel)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+@st.cache_data(show_spinner=False)
+def compute_top_comp_brands(src, where, params, pump_house_name="Pump House"):
+    # Pump House first, then the 5 closest competitors; both are TOP-N
+    # queries in DuckDB rather than a full brand-list materialization
+    pump_where = where + (" AND " if where else " WHERE ") + "LOWER(s.Brand) LIKE ?"
+    pump = con.execute(f"""
+        SELECT s.Brand {src}{pump_where}
+        GROUP BY 1 ORDER BY SUM(s.Dollars) DESC LIMIT 1
+    """, params + [f"%{pump_house_name.lower()}%"]).fetchone()
+    top = [r[0] for r in con.execute(f"""
+        SELECT s.Brand {src}{where}
+        GROUP BY 1 ORDER BY SUM(s.Dollars) DESC LIMIT 6
+    """, params).fetchall()]
+    pump = [pump[0]] if pump else top[:1]
+    seen = set(pump)
+    return pump + [b for b in top if b not in seen][:5]
+
+# Everything a single filter combination renders, cached as one unit
+View = namedtuple("View", [
+    "n_rows", "total_dollars", "total_units", "stores_active",
+    "top_store", "top_sku", "ordered_brands", "brand_totals",
+    "map_df", "top10", "lb_stores", "lb_brands", "rows",
+])
+
+@st.cache_data(show_spinner=False)
+def compute_view(fiscal_week_sel, brand_sel, store_sel, city_sel, sku_sel):
+    if not sales_exist():
+        return View(0, 0.0, 0.0, 0, None, None, [], None, None, None, None, None, None)
+    where, params = build_filters(fiscal_week_sel, brand_sel, store_sel, city_sel, sku_sel)
+    # Aggregates route at the weekly rollup unless a Product filter forces
+    # the row-level dataset (the rollup has no Product column)
+    src = FILTERED_SALES if sku_sel else WEEKLY_SALES
+    # One plan over the filtered scan for every scalar KPI, top store included
+    n_rows, total_dollars, total_units, stores_active, top_store = con.execute(f"""
+        WITH f AS (SELECT s.Dollars, s.QtySold, s.StoreCode {src}{where})
+        SELECT (SELECT COUNT(*) FROM f),
+               (SELECT COALESCE(SUM(Dollars), 0) FROM f),
+               (SELECT COALESCE(SUM(QtySold), 0) FROM f),
+               (SELECT COUNT(DISTINCT StoreCode) FROM f),
+               (SELECT StoreCode FROM f GROUP BY 1 ORDER BY SUM(Dollars) DESC LIMIT 1)
+    """, params).fetchone()
+    if not n_rows:
+        return View(0, 0.0, 0.0, 0, None, None, [], None, None, None, None, None, None)
+
+    # Top product needs row-level data
+    top_sku = con.execute(f"""
+        SELECT s.Product {FILTERED_SALES}{where}
+        GROUP BY 1 ORDER BY SUM(s.Dollars) DESC LIMIT 1
+    """, params).fetchone()
+    top_sku = top_sku[0] if top_sku else None
+
+    ordered_brands = compute_top_comp_brands(src, where, params, pump_house_name="Pump House")
+    brand_pred = "s.Brand IN ({})".format(", ".join("?" * len(ordered_brands)))
+    brand_where = where + (" AND " if where else " WHERE ") + brand_pred
+    brand_totals = con.execute(f"""
+        SELECT s.FiscalWeek, s.Brand, SUM(s.Dollars) AS Dollars
+        {src}{brand_where}
+        GROUP BY 1, 2
+    """, params + list(ordered_brands)).df()
+
+    map_df = con.execute(f"""
+        SELECT s.StoreCode, st.StoreName, st.City, st.Lat, st.Lon, SUM(s.Dollars) AS Dollars
+        {src}{where}
+        GROUP BY 1, 2, 3, 4, 5
+    """, params).df().dropna(subset=["Lat","Lon"])
+
+    # The map-side table and the store leaderboard show the same top 10;
+    # compute it once
+    top10 = con.execute(f"""
+        SELECT s.StoreCode, st.StoreName, SUM(s.Dollars) AS Dollars
+        {src}{where}
+        GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 10
+    """, params).df()
+    lb_stores = top10
+    lb_brands = con.execute(f"""
+        SELECT s.Brand, SUM(s.Dollars) AS Dollars
+        {src}{where}
+        GROUP BY 1 ORDER BY 2 DESC LIMIT 10
+    """, params).df()
+
+    rows = con.execute(f"""
         SELECT s.*, st.StoreName, st.City, st.Province, st.Lat, st.Lon
-        FROM sales s
-        LEFT JOIN stores st ON st.StoreCode = s.StoreCode
-    """).df()
-    return df
-
-def compute_top_comp_brands(df: pd.DataFrame, pump_house_name="Pump House"):
-    # total by brand
-    t = df.groupby("Brand", as_index=False)["Dollars"].sum().sort_values("Dollars", ascending=False)
-    # Pump House first, then 5 closest competitors
-    brands = t["Brand"].tolist()
-    pump = [b for b in brands if pump_house_name.lower() in str(b).lower()]
-    pump = pump[:1] if pump else brands[:1]
-    others = [b for b in brands if b not in pump][:5]
-    ordered = pump + others
-    return ordered
+        {FILTERED_SALES}{where}
+    """, params).df()
+    # Category codes shrink the cached frame and keep any pandas work on it
+    # (sorting, rendering, CSV export) off Python string objects
+    for c in ("FiscalWeek", "Brand", "StoreCode", "City", "Product", "StoreName", "Class", "Container"):
+        if c in rows.columns:
+            rows[c] = rows[c].astype("category")
+    # Partitions written before the REAL cast come back as float64; downcast
+    for c in SALES_REAL_COLUMNS:
+        if c in rows.columns and rows[c].dtype != "float32":
+            rows[c] = rows[c].astype("float32")
+    return View(n_rows, total_dollars, total_units, stores_active,
+                top_store, top_sku,
+                ordered_brands, brand_totals, map_df, top10, lb_stores, lb_brands, rows)
 
 # ----------------------
 # UI
@@ -181,88 +411,70 @@ st.caption("Dark-mode, Pump House first. Upload monthly XLS or paste a direct li
 
 with st.sidebar:
     st.subheader("Filters")
-    df_all = load_data()
-    if df_all.empty:
+    fiscal_weeks, brands, stores, cities, skus = sidebar_options()
+    if not fiscal_weeks:
         st.info("No data yet. Go to Admin to upload your first XLS.")
-    fiscal_weeks = sorted(df_all["FiscalWeek"].dropna().unique().tolist())
     fiscal_week_sel = st.multiselect("Fiscal Week", fiscal_weeks, default=fiscal_weeks[-4:] if fiscal_weeks else [])
-    brands = sorted(df_all["Brand"].dropna().unique().tolist())
     brand_sel = st.multiselect("Brand", brands, default=[])
-    stores = sorted(df_all["StoreCode"].dropna().unique().tolist())
     store_sel = st.multiselect("Store Code", stores, default=[])
-    cities = sorted(df_all["City"].dropna().unique().tolist())
     city_sel = st.multiselect("City", cities, default=[])
-    skus = sorted(df_all["Product"].dropna().unique().tolist())
-    sku_sel = st.multiselect("Product", [], default=[])
-
-    # Apply filters
-    df = df_all.copy()
-    if fiscal_week_sel:
-        df = df[df["FiscalWeek"].isin(fiscal_week_sel)]
-    if brand_sel:
-        df = df[df["Brand"].isin(brand_sel)]
-    if store_sel:
-        df = df[df["StoreCode"].isin(store_sel)]
-    if city_sel:
-        df = df[df["City"].isin(city_sel)]
-    if sku_sel:
-        df = df[df["Product"].isin(sku_sel)]
+    sku_sel = st.multiselect("Product", skus, default=[])
 
-# KPI Section
-if not df.empty:
-    total_dollars = df["Dollars"].sum()
-    total_units = df["QtySold"].sum()
-    stores_active = df["StoreCode"].nunique()
-    top_store = df.groupby("StoreCode")["Dollars"].sum().sort_values(ascending=False).head(1)
-    top_sku = df.groupby("Product")["Dollars"].sum().sort_values(ascending=False).head(1)
+view = compute_view(tuple(sorted(fiscal_week_sel)), tuple(sorted(brand_sel)),
+                    tuple(sorted(store_sel)), tuple(sorted(city_sel)),
+                    tuple(sorted(sku_sel)))
 
+# KPI Section
+if view.n_rows:
     c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("Total Dollars", f"${total_dollars:,.0f}")
-    c2.metric("Total Units", f"{int(total_units):,}")
-    c3.metric("Active Stores", f"{stores_active}")
-    c4.metric("Top Store", top_store.index[0] if not top_store.empty else "—")
-    c5.metric("Top Product", top_sku.index[0] if not top_sku.empty else "—")
+    c1.metric("Total Dollars", f"${view.total_dollars:,.0f}")
+    c2.metric("Total Units", f"{int(view.total_units):,}")
+    c3.metric("Active Stores", f"{view.stores_active}")
+    c4.metric("Top Store", view.top_store or "—")
+    c5.metric("Top Product", view.top_sku or "—")
 
 # BRAND SHARE
-if not df.empty:
-    ordered_brands = compute_top_comp_brands(df, pump_house_name="Pump House")
-    df_comp = df[df["Brand"].isin(ordered_brands)]
-    brand_totals = df_comp.groupby(["FiscalWeek","Brand"], as_index=False)["Dollars"].sum()
-    fig = px.area(brand_totals, x="FiscalWeek", y="Dollars", color="Brand", category_orders={"Brand": ordered_brands})
+if view.n_rows:
+    fig = px.area(view.brand_totals, x="FiscalWeek", y="Dollars", color="Brand",
+                  category_orders={"Brand": list(view.ordered_brands)})
     st.plotly_chart(fig, use_container_width=True, theme="streamlit")
 
 # MAP + TOP STORES
-if not df.empty:
+if view.n_rows:
     cc1, cc2 = st.columns([2,1])
     with cc1:
-        map_df = df.groupby(["StoreCode","StoreName","City","Lat","Lon"], as_index=False)["Dollars"].sum()
-        map_df = map_df.dropna(subset=["Lat","Lon"])
-        if not map_df.empty:
-            figm = px.scatter_mapbox(map_df, lat="Lat", lon="Lon", size="Dollars", hover_name="StoreName",
+        if not view.map_df.empty:
+            figm = px.scatter_mapbox(view.map_df, lat="Lat", lon="Lon", size="Dollars", hover_name="StoreName",
                                      hover_data={"City":True,"Dollars":":,.0f"}, zoom=5, height=500)
             figm.update_layout(mapbox_style="carto-darkmatter", margin=dict(l=0,r=0,t=0,b=0))
             st.plotly_chart(figm, use_container_width=True, theme="streamlit")
         else:
             st.info("Add lat/lon to the store directory to enable the map.")
     with cc2:
-        top10 = df.groupby(["StoreCode","StoreName"], as_index=False)["Dollars"].sum().sort_values("Dollars", ascending=False).head(10)
-        st.dataframe(top10, use_container_width=True)
+        st.dataframe(view.top10, use_container_width=True)
 
 # LEADERBOARDS
-if not df.empty:
+if view.n_rows:
     st.subheader("Leaderboards")
     cc3, cc4 = st.columns(2)
     with cc3:
-        lb_stores = df.groupby(["StoreCode","StoreName"], as_index=False)["Dollars"].sum().sort_values("Dollars", ascending=False).head(10)
-        st.dataframe(lb_stores, use_container_width=True)
+        st.dataframe(view.lb_stores, use_container_width=True)
     with cc4:
-        lb_brands = df.groupby("Brand", as_index=False)["Dollars"].sum().sort_values("Dollars", ascending=False).head(10)
-        st.dataframe(lb_brands, use_container_width=True)
+        st.dataframe(view.lb_brands, use_container_width=True)
 
 # DATA TABLE + CSV EXPORT
 st.subheader("Data")
-if not df.empty:
-    st.download_button("Download current view as CSV", df.to_csv(index=False).encode("utf-8"), file_name="pumphouse_filtered.csv", mime="text/csv")
+if view.n_rows:
+    df = view.rows
+    # Arrow writers emit UTF-8 bytes directly, skipping pandas' str round-trip
+    export_tbl = pa.Table.from_pandas(df, preserve_index=False)
+    csv_buf = io.BytesIO()
+    pacsv.write_csv(export_tbl, csv_buf)
+    pq_buf = io.BytesIO()
+    papq.write_table(export_tbl, pq_buf)
+    d1, d2 = st.columns(2)
+    d1.download_button("Download current view as CSV", csv_buf.getvalue(), file_name="pumphouse_filtered.csv", mime="text/csv")
+    d2.download_button("Download current view as Parquet", pq_buf.getvalue(), file_name="pumphouse_filtered.parquet", mime="application/octet-stream")
     st.dataframe(df, use_container_width=True, height=500)
 
 # ----------------------
@@ -273,7 +485,7 @@ st.header("Admin")
 if st.session_state.get("is_admin") or st.text_input("Enter Admin Password", type="password") == os.environ.get("ADMIN_PASSWORD", "changeme"):
     st.session_state["is_admin"] = True
     st.success("Admin mode")
-    st.write("Upload monthly XLS or paste a direct XLS URL. Files with the same FiscalWeek/Product/StoreCode will replace prior rows.")
+    st.write("Upload monthly XLS or paste a direct XLS URL. Files covering the same FiscalYear/FiscalWeek replace prior rows for those weeks.")
 
     up_col, url_col = st.columns(2)
     with up_col:
@@ -281,10 +493,10 @@ if st.session_state.get("is_admin") or st.text_input("Enter Admin Password", typ
         if upf:
             data = upf.read()
             parsed = parse_supplier_report(data)
-            if parsed.empty:
+            if parsed.num_rows == 0:
                 st.error("Could not parse any sales rows.")
             else:
-                st.dataframe(parsed.head(20))
+                st.dataframe(parsed.slice(0, 20).to_pandas())
                 if st.button("Ingest uploaded file"):
                     count = upsert_sales(parsed)
                     st.success(f"Ingested {count:,} rows.")
@@ -294,7 +506,7 @@ if st.session_state.get("is_admin") or st.text_input("Enter Admin Password", typ
             try:
                 b = fetch_xls_from_url(url)
                 parsed = parse_supplier_report(b)
-                if parsed.empty:
+                if parsed.num_rows == 0:
                     st.error("Parsed zero rows.")
                 else:
                     count = upsert_sales(parsed)
@@ -306,11 +518,44 @@ if st.session_state.get("is_admin") or st.text_input("Enter Admin Password", typ
     st.write("Upload a CSV with columns: StoreCode,StoreName,Address,City,Province,Lat,Lon")
     stores_csv = st.file_uploader("Upload Stores CSV", type=["csv"], key="stores")
     if stores_csv:
-        sdf = pd.read_csv(stores_csv, dtype={"StoreCode":str})
-        sdf["StoreCode"] = sdf["StoreCode"].str.zfill(3)
-        con.execute("DELETE FROM stores")
-        con.execute("INSERT INTO stores SELECT * FROM sdf")
-        st.success(f"Loaded {len(sdf)} stores.")
+        # DuckDB parses the CSV directly with typed columns; no pandas pass
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as tmp:
+            tmp.write(stores_csv.getvalue())
+            csv_path = tmp.name
+        wcur = _db().cursor()
+        try:
+            # Stage first so a malformed CSV fails before stores is touched.
+            # The swap then runs as plain autocommit statements: deleting a
+            # PK row and re-inserting the same key inside one transaction
+            # trips DuckDB's primary-key check on every re-upload.
+            wcur.execute("""
+                CREATE OR REPLACE TEMP TABLE stores_staging AS
+                SELECT StoreCode, StoreName, Address, City, Province, Lat, Lon
+                FROM read_csv_auto(?, types = {'StoreCode': 'VARCHAR'})
+            """, [csv_path])
+            wcur.execute("DELETE FROM stores")
+            wcur.execute("""
+                INSERT INTO stores
+                SELECT lpad(StoreCode, 3, '0'), StoreName, Address, City, Province, Lat, Lon
+                FROM stores_staging
+            """)
+            wcur.execute("DROP TABLE stores_staging")
+            n_stores = wcur.execute("SELECT COUNT(*) FROM stores").fetchone()[0]
+        except Exception as e:
+            n_stores = None
+            st.error(f"Store load failed: {e}")
+        finally:
+            wcur.close()
+            os.unlink(csv_path)
+        if n_stores is not None:
+            st.cache_data.clear()
+            st.success(f"Loaded {n_stores} stores.")
+
+    st.subheader("Maintenance")
+    st.write("Re-sort the sales dataset by fiscal year/week/store. Run occasionally after many ingests to keep scans fast.")
+    if st.button("Re-sort sales dataset"):
+        resort_sales()
+        st.success("Sales dataset re-sorted.")
 
 else:
     st.info("Enter the Admin password to upload data.")